@@ -0,0 +1 @@
+"""FinBot RAG pipeline and shared helpers for the voice/chat servers"""
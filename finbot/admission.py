@@ -0,0 +1,306 @@
+"""
+Admission control for upstream LLM calls.
+
+Each backend (Mistral, Gemini, ...) gets an AdmissionController that bounds
+concurrent calls, rate-limits them with a token bucket and queues the rest
+by priority. A caller that cannot be admitted before its queue deadline is
+shed with `Overloaded` so it can answer with a fast degraded response instead
+of piling onto an upstream that is already rate limiting us.
+
+Works from both plain threads (`with ctrl.admit(...)`) and asyncio
+(`async with ctrl.admit_async(...)`), sharing the same queue.
+"""
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from enum import IntEnum
+from typing import Dict, Optional
+
+
+class Priority(IntEnum):
+    """Lower value is served first"""
+    VOICE = 0
+    CHAT = 1
+    BATCH = 2
+
+
+class Overloaded(Exception):
+    """Raised when a call is shed instead of being admitted"""
+
+    def __init__(self, backend: str, reason: str):
+        super().__init__(f"{backend} overloaded: {reason}")
+        self.backend = backend
+        self.reason = reason
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `rate` tokens/sec"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, max_wait: float) -> Optional[float]:
+        """
+        Take one token, possibly from the future.
+        Returns how long the caller must wait before using it, or None
+        (and takes nothing) if that wait would exceed max_wait.
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            self._refill(time.monotonic())
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if wait > max_wait:
+                return None
+            self._tokens -= 1
+            return wait
+
+
+class _Waiter:
+    __slots__ = ("priority", "deadline", "granted", "cancelled", "reason",
+                 "_event", "_loop", "_future")
+
+    def __init__(self, priority: Priority, deadline: float,
+                 loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.priority = priority
+        self.deadline = deadline
+        self.granted = False
+        self.cancelled = False
+        self.reason = "queue deadline exceeded"
+        self._loop = loop
+        if loop is None:
+            self._event = threading.Event()
+            self._future = None
+        else:
+            self._event = None
+            self._future = loop.create_future()
+
+    def wake(self):
+        if self._event is not None:
+            self._event.set()
+        else:
+            self._loop.call_soon_threadsafe(self._set_future)
+
+    def _set_future(self):
+        if not self._future.done():
+            self._future.set_result(None)
+
+
+class AdmissionController:
+    """Concurrency limit + token bucket + priority queue for one backend"""
+
+    def __init__(self,
+                 name: str,
+                 max_concurrency: int = 8,
+                 rate: float = 0.0,
+                 burst: Optional[float] = None,
+                 max_queue: int = 32,
+                 queue_timeout: Optional[Dict[Priority, float]] = None):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = {
+            Priority.VOICE: 1.5,
+            Priority.CHAT: 5.0,
+            Priority.BATCH: 60.0,
+        }
+        if queue_timeout:
+            self.queue_timeout.update(queue_timeout)
+        self.bucket = TokenBucket(rate, burst if burst is not None else max(1.0, rate))
+
+        self._lock = threading.Lock()
+        self._heap = []
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._queued = 0
+        self.admitted = 0
+        # Callers that gave up (task cancelled) while queued; not load shedding
+        self.cancelled = 0
+        self.extra_attempts = {"granted": 0, "refused": 0}
+        self.shed: Dict[str, int] = {"queue_full": 0, "preempted": 0,
+                                     "deadline": 0, "rate_limited": 0}
+
+    # ── queue bookkeeping ─────────────────────────────────────────
+
+    def _try_enter(self, waiter: _Waiter) -> bool:
+        """Take a slot immediately or enqueue the waiter. Caller holds no lock."""
+        with self._lock:
+            if self._in_flight < self.max_concurrency and not self._queued:
+                self._in_flight += 1
+                waiter.granted = True
+                return True
+            if self._queued >= self.max_queue and not self._preempt(waiter.priority):
+                self.shed["queue_full"] += 1
+                raise Overloaded(self.name, "queue full")
+            heapq.heappush(self._heap, (int(waiter.priority), next(self._seq), waiter))
+            self._queued += 1
+            return False
+
+    def _preempt(self, priority: Priority) -> bool:
+        """
+        Shed the newest lowest-priority waiter to make room for a more urgent
+        arrival. Caller holds the lock. Returns False if nobody ranks below it.
+        """
+        victim = None
+        for prio, seq, waiter in self._heap:
+            if waiter.cancelled or prio <= priority:
+                continue
+            if victim is None or (prio, seq) > victim[:2]:
+                victim = (prio, seq, waiter)
+        if victim is None:
+            return False
+        waiter = victim[2]
+        waiter.cancelled = True
+        waiter.reason = "preempted by higher priority call"
+        self._queued -= 1
+        self.shed["preempted"] += 1
+        waiter.wake()
+        return True
+
+    def _abandon(self, waiter: _Waiter, by_caller: bool = False) -> bool:
+        """
+        Give up waiting, on the queue deadline or because the caller was
+        cancelled. Returns True if the slot was granted in the meantime.
+        """
+        with self._lock:
+            if waiter.granted:
+                return True
+            if waiter.cancelled:
+                # Already expired or preempted, and counted there.
+                return False
+            waiter.cancelled = True
+            self._queued -= 1
+            if by_caller:
+                self.cancelled += 1
+            else:
+                self.shed["deadline"] += 1
+            return False
+
+    def _release(self):
+        now = time.monotonic()
+        with self._lock:
+            self._in_flight -= 1
+            while self._heap and self._in_flight < self.max_concurrency:
+                _, _, waiter = heapq.heappop(self._heap)
+                if waiter.cancelled:
+                    continue
+                self._queued -= 1
+                if waiter.deadline <= now:
+                    # It will time out on its own; don't hand it a slot.
+                    waiter.cancelled = True
+                    self.shed["deadline"] += 1
+                    waiter.wake()
+                    continue
+                waiter.granted = True
+                self._in_flight += 1
+                waiter.wake()
+
+    def _reserve_token(self, deadline: float) -> float:
+        wait = self.bucket.reserve(max(0.0, deadline - time.monotonic()))
+        if wait is None:
+            with self._lock:
+                self.shed["rate_limited"] += 1
+            self._release()
+            raise Overloaded(self.name, "rate limit")
+        return wait
+
+    def _deadline(self, priority: Priority, timeout: Optional[float]) -> float:
+        if timeout is None:
+            timeout = self.queue_timeout[priority]
+        return time.monotonic() + timeout
+
+    def _admitted(self):
+        with self._lock:
+            self.admitted += 1
+
+    # ── public API ────────────────────────────────────────────────
+
+    @contextmanager
+    def admit(self, priority: Priority = Priority.CHAT, timeout: Optional[float] = None):
+        """Blocking admission for threaded callers"""
+        deadline = self._deadline(priority, timeout)
+        waiter = _Waiter(priority, deadline)
+        if not self._try_enter(waiter):
+            waiter._event.wait(max(0.0, deadline - time.monotonic()))
+            if not waiter.granted and not self._abandon(waiter):
+                raise Overloaded(self.name, waiter.reason)
+        wait = self._reserve_token(deadline)
+        if wait:
+            time.sleep(wait)
+        self._admitted()
+        try:
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def admit_async(self, priority: Priority = Priority.CHAT, timeout: Optional[float] = None):
+        """Non-blocking admission for asyncio callers"""
+        deadline = self._deadline(priority, timeout)
+        waiter = _Waiter(priority, deadline, asyncio.get_running_loop())
+        if not self._try_enter(waiter):
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter._future),
+                                       max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                if self._abandon(waiter, by_caller=True):
+                    self._release()
+                raise
+            if not waiter.granted and not self._abandon(waiter):
+                raise Overloaded(self.name, waiter.reason)
+        wait = self._reserve_token(deadline)
+        if wait:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                self._release()
+                raise
+        self._admitted()
+        try:
+            yield
+        finally:
+            self._release()
+
+    def reserve_extra(self, max_wait: float = 0.0) -> Optional[float]:
+        """
+        Token for a retry or hedge made inside an already admitted call.
+        Refused (None) while callers are queueing or the bucket can't supply
+        one within max_wait, so extra attempts never add load we are shedding.
+        Returns how long to wait before sending the attempt.
+        """
+        with self._lock:
+            queueing = self._queued > 0
+        wait = None if queueing else self.bucket.reserve(max_wait)
+        with self._lock:
+            self.extra_attempts["refused" if wait is None else "granted"] += 1
+        return wait
+
+    def stats(self) -> dict:
+        """Snapshot of queue depth, in-flight calls and shed counters"""
+        with self._lock:
+            return {
+                "backend": self.name,
+                "in_flight": self._in_flight,
+                "max_concurrency": self.max_concurrency,
+                "queue_depth": self._queued,
+                "max_queue": self.max_queue,
+                "admitted": self.admitted,
+                "cancelled": self.cancelled,
+                "extra_attempts": dict(self.extra_attempts),
+                "shed": dict(self.shed),
+                "shed_total": sum(self.shed.values()),
+            }
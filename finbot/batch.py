@@ -0,0 +1,228 @@
+"""
+Batch question answering over the FinBot RAG pipeline.
+
+Reads questions from JSONL ({"id": ..., "question": ...}) or CSV (columns
+`id`, `question`; `id` is optional in both and defaults to "line-<n>"/"row-<n>";
+duplicate ids are rejected), then streams them through batched embedding +
+FAISS search and concurrent Gemini generation, rate-limited by this process's
+Gemini governor (it does not coordinate with other processes). Answers are
+appended to a JSONL file as they finish; that file doubles as the checkpoint,
+so re-running the same command after an interruption (including Ctrl-C)
+skips questions that already have an answer. Failed or shed questions are
+not written and get retried on the next run.
+
+Usage (from the repo root, with index.faiss and docs.pkl in the working directory):
+    python -m finbot.batch questions.jsonl -o answers.jsonl --workers 8
+"""
+
+import argparse
+import csv
+import json
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterator, List, Optional, Set
+
+from tqdm import tqdm
+
+
+def _iter_rows(path: str) -> Iterator[Dict]:
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            for n, row in enumerate(csv.DictReader(f)):
+                if not row.get("id"):
+                    row["id"] = f"row-{n}"
+                yield row
+        return
+
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if record.get("id") is None:
+                record["id"] = f"line-{n}"
+            yield record
+
+
+def read_questions(path: str) -> Iterator[Dict]:
+    """
+    Yield {"id", "question", ...} records from a .jsonl or .csv file.
+    Raises ValueError on a repeated id, since resuming keys on it.
+    """
+    seen = set()
+    for record in _iter_rows(path):
+        record["id"] = str(record["id"])
+        if record["id"] in seen:
+            raise ValueError(f"Duplicate id {record['id']!r} in {path}")
+        seen.add(record["id"])
+        yield record
+
+
+def completed_ids(out_path: str) -> Set[str]:
+    """Ids already answered in a previous (possibly interrupted) run"""
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                done.add(str(json.loads(line)["id"]))
+            except (ValueError, KeyError):
+                # Torn last line from a killed run
+                continue
+    return done
+
+
+def run_batch(records: List[Dict],
+              out_path: str,
+              answer_fn: Callable[[str, List[Dict]], str],
+              retrieve_fn: Callable[[List[str]], List[List[Dict]]],
+              is_failure: Callable[[str], bool],
+              batch_size: int = 64,
+              workers: int = 8,
+              status_fn: Optional[Callable[[], Dict]] = None) -> Dict[str, int]:
+    """
+    Answer every record not already in out_path.
+    retrieve_fn embeds and searches a whole chunk at once; answer_fn is called
+    concurrently with each question and its passages. status_fn, if given,
+    returns extra fields for the progress bar (e.g. governor queue and shed).
+    """
+    done = completed_ids(out_path)
+    counts = {"skipped": 0, "invalid": 0, "answered": 0, "failed": 0}
+    todo = []
+    for record in records:
+        question = record.get("question")
+        if record["id"] in done:
+            counts["skipped"] += 1
+        elif not isinstance(question, str) or not question.strip():
+            counts["invalid"] += 1
+        else:
+            todo.append(record)
+    if not todo:
+        return counts
+
+    write_lock = threading.Lock()
+    progress = tqdm(total=len(todo), unit="q", desc="answering")
+    pool = ThreadPoolExecutor(max_workers=workers)
+    pending = set()
+
+    def answer(record, passages):
+        try:
+            return record, answer_fn(record["question"], passages)
+        except Exception as e:
+            return record, f"Error: {e}"
+
+    with open(out_path, "a", encoding="utf-8") as out:
+
+        def collect(futures):
+            for future in futures:
+                record, answer = future.result()
+                with write_lock:
+                    if is_failure(answer):
+                        counts["failed"] += 1
+                    else:
+                        out.write(json.dumps({**record, "answer": answer}) + "\n")
+                        out.flush()
+                        counts["answered"] += 1
+                progress.update(1)
+            progress.set_postfix(failed=counts["failed"], **(status_fn() if status_fn else {}))
+
+        try:
+            for i in range(0, len(todo), batch_size):
+                chunk = todo[i:i + batch_size]
+                # Retrieve the next chunk while the pool is still generating
+                passages = retrieve_fn([r["question"] for r in chunk])
+                for record, found in zip(chunk, passages):
+                    pending.add(pool.submit(answer, record, found))
+                # Keep at most ~two chunks in flight so memory stays flat
+                while len(pending) > batch_size:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(finished)
+
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+        except KeyboardInterrupt:
+            # Drop queued calls and keep whatever already came back. The at
+            # most `workers` calls already in flight are bounded by the
+            # Gemini deadline; their answers are picked up on resume.
+            pool.shutdown(wait=False, cancel_futures=True)
+            collect([f for f in pending if f.done() and not f.cancelled()])
+            progress.close()
+            raise
+
+    pool.shutdown()
+    progress.close()
+    return counts
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Answer a JSONL/CSV of questions with FinBot")
+    parser.add_argument("questions", help="input .jsonl or .csv with a 'question' field")
+    parser.add_argument("-o", "--out", default="answers.jsonl",
+                        help="output JSONL, also used to resume (default: answers.jsonl)")
+    parser.add_argument("--batch-size", type=int, default=64,
+                        help="questions per embedding/search batch")
+    parser.add_argument("--workers", type=int, default=8,
+                        help="concurrent generation calls (still capped by this process's Gemini governor)")
+    parser.add_argument("-k", type=int, default=6, help="passages retrieved per question")
+    parser.add_argument("--no-web", action="store_true", help="disable web search fallback")
+    parser.add_argument("--score-threshold", type=float, default=0.7)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    # Imported here: loading main pulls in the index, embedder and Gemini client
+    from finbot.admission import Priority
+    from finbot.main import OVERLOADED_ANSWER, gemini_governor, rag_chat_with_websearch, retrieve_batch
+
+    try:
+        records = list(read_questions(args.questions))
+    except ValueError as e:
+        raise SystemExit(f"Error: {e}")
+    print(f"Loaded {len(records)} questions from {args.questions}")
+
+    def answer_fn(question, passages):
+        return rag_chat_with_websearch(question,
+                                       k=args.k,
+                                       use_web_fallback=not args.no_web,
+                                       score_threshold=args.score_threshold,
+                                       priority=Priority.BATCH,
+                                       local_passages=passages,
+                                       # Per-question prints would break up the progress bar
+                                       verbose=False)
+
+    def governor_status():
+        stats = gemini_governor.stats()
+        return {"queued": stats["queue_depth"], "shed": stats["shed_total"]}
+
+    def print_governor_stats():
+        stats = gemini_governor.stats()
+        print(f"Gemini admission: admitted {stats['admitted']}, shed {stats['shed_total']} "
+              f"{stats['shed']}, extra attempts {stats['extra_attempts']}")
+
+    try:
+        counts = run_batch(records,
+                           args.out,
+                           answer_fn=answer_fn,
+                           retrieve_fn=lambda qs: retrieve_batch(qs, args.k),
+                           is_failure=lambda a: a.startswith("Error") or a == OVERLOADED_ANSWER,
+                           batch_size=args.batch_size,
+                           workers=args.workers,
+                           status_fn=governor_status)
+    except KeyboardInterrupt:
+        print_governor_stats()
+        raise SystemExit(f"\nInterrupted; finished answers are in {args.out}. "
+                         "Re-run the same command to resume.")
+
+    print(f"Answered {counts['answered']}, failed {counts['failed']}, "
+          f"skipped {counts['skipped']} already in {args.out}")
+    print_governor_stats()
+    if counts["invalid"]:
+        print(f"Ignored {counts['invalid']} records with a missing or empty question")
+    if counts["failed"]:
+        print("Re-run the same command to retry failed questions")
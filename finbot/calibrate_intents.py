@@ -0,0 +1,60 @@
+"""
+Check an intent file's thresholds against its calibration probes.
+
+Each probe is a transcript and the intent it should be answered with (null
+for "must fall through to the LLM"); they should differ from the examples
+and near-misses in the file, so passing them shows the thresholds and margin
+generalise rather than just memorising the table. Prints the score,
+runner-up and near-miss for every probe and exits non-zero if any decision is
+wrong. The server runs the same check at startup and keeps instant answers
+off until it passes, so run this after editing the file or changing
+EMBED_MODEL.
+
+Usage (from the repo root):
+    python -m finbot.calibrate_intents intents.json [--margin 0.05]
+"""
+
+import argparse
+import sys
+
+from finbot.intents import EMBED_MODEL, IntentMatcher, load_intent_file
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Check intent thresholds against probe phrasings")
+    parser.add_argument("intents", help="intent file (see finbot/intents.example.json)")
+    parser.add_argument("--model", default=EMBED_MODEL)
+    parser.add_argument("--margin", type=float, default=0.05)
+    args = parser.parse_args(argv)
+
+    try:
+        intents, probes = load_intent_file(args.intents)
+    except (OSError, ValueError) as e:
+        print(f"Error: cannot load {args.intents}: {e}")
+        return 2
+    if not probes:
+        print(f"Error: {args.intents} has no probes")
+        return 2
+
+    from sentence_transformers import SentenceTransformer
+    matcher = IntentMatcher(SentenceTransformer(args.model, device="cpu"), intents,
+                            margin=args.margin)
+
+    rows = matcher.calibrate(probes)
+    for row in rows:
+        print(f"{'ok  ' if row['ok'] else 'FAIL'} {row['text']!r:55} -> {row['got'] or '-':16} "
+              f"best={row['intent'].name}:{row['score']:.3f} "
+              f"runner_up={row['runner_up']:.3f} near_miss={row['near_miss']:.3f}")
+
+    failures = sum(not row["ok"] for row in rows)
+    print(f"{len(rows) - failures}/{len(rows)} probes decided correctly "
+          f"(margin {args.margin}, thresholds "
+          f"{', '.join(f'{i.name}={i.threshold}' for i in intents)})")
+    unanswered = [intent.name for intent in intents if not intent.answer.strip()]
+    if unanswered:
+        print(f"Note: no approved answer yet for {unanswered}; the server keeps instant answers off")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
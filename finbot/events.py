@@ -0,0 +1,192 @@
+"""
+Call-event ingestion off the request hot path.
+
+Handlers call `EventSink.emit(kind, call_id, payload)`, which only does a
+non-blocking put onto a bounded queue. A background thread drains the queue
+in batches and appends them to a local SQLite table, committing every
+`batch_size` events or `flush_interval` seconds, whichever comes first.
+When the queue is full new events are dropped and counted rather than
+blocking the event loop.
+
+The event DB is the one place call content is kept: webhook payloads,
+the latest utterance of each frame, the full transcript on call_ended and
+intent lookups are stored as-is (not hashed), so misses can be reviewed.
+Treat the file like call recordings: restrict access and rotate it.
+
+`SampledLogger` keeps a 1-in-N sample of high-volume log lines; the message
+is only formatted for the lines that are actually kept.
+"""
+
+import json
+import logging
+import queue
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS call_events (
+    id      INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts      REAL NOT NULL,
+    kind    TEXT NOT NULL,
+    call_id TEXT,
+    payload TEXT
+)
+"""
+
+_STOP = object()
+
+
+class EventSink:
+    """Bounded in-process queue with a batching SQLite writer thread"""
+
+    def __init__(self,
+                 path: str = "call_events.db",
+                 max_queue: int = 10000,
+                 batch_size: int = 500,
+                 flush_interval: float = 1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self.emitted = 0
+        self.dropped = 0
+        self.written = 0
+        self.write_errors = 0
+        self.error: Optional[str] = None
+
+    def emit(self, kind: str, call_id: Optional[str] = None, payload: Any = None):
+        """Enqueue an event without blocking; drops it if the queue is full"""
+        if self.error is not None and self._thread is not None and not self._thread.is_alive():
+            # Writer never started; don't let the queue fill up silently
+            self.dropped += 1
+            return
+        try:
+            self._queue.put_nowait((time.time(), kind, call_id, payload))
+            self.emitted += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="event-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Flush whatever is queued and stop the writer"""
+        if self._thread is None:
+            return
+        # Wait for room so the stop marker isn't lost to a full queue
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logger.warning("Event writer not draining; stopping without final flush")
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _open(self) -> Optional[sqlite3.Connection]:
+        try:
+            db = sqlite3.connect(self.path)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(SCHEMA)
+            db.commit()
+            return db
+        except sqlite3.Error as e:
+            self.error = f"cannot open {self.path}: {e}"
+            logger.error(f"Call-event writer not started, events will be dropped: {self.error}")
+            return None
+
+    def _run(self):
+        db = self._open()
+        if db is None:
+            return
+
+        try:
+            stopping = False
+            while not stopping:
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    try:
+                        item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+                if batch:
+                    self._write(db, batch)
+        except Exception as e:
+            # Should not happen (_write handles its own errors), but if it
+            # does, make emit() drop and count instead of filling the queue
+            self.error = f"writer stopped: {e!r}"
+            logger.exception(f"Call-event writer stopped, events will be dropped: {e!r}")
+        finally:
+            db.close()
+
+    def _write(self, db: sqlite3.Connection, batch: list):
+        rows = []
+        for ts, kind, call_id, payload in batch:
+            try:
+                rows.append((ts, kind, call_id, json.dumps(payload, default=str)))
+            except Exception as e:
+                # e.g. a circular reference; skip the event, keep the batch
+                self.write_errors += 1
+                logger.error(f"Dropping unserializable {kind} event: {e!r}")
+        if not rows:
+            return
+        try:
+            db.executemany(
+                "INSERT INTO call_events (ts, kind, call_id, payload) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            db.commit()
+            self.written += len(rows)
+        except Exception as e:
+            self.write_errors += len(rows)
+            logger.error(f"Failed to write {len(rows)} call events: {e!r}")
+            try:
+                db.rollback()
+            except sqlite3.Error:
+                pass
+
+    def stats(self) -> dict:
+        """Queue depth and emitted/written/dropped counters"""
+        return {
+            "queue_depth": self._queue.qsize(),
+            "max_queue": self._queue.maxsize,
+            "emitted": self.emitted,
+            "written": self.written,
+            "dropped": self.dropped,
+            "write_errors": self.write_errors,
+            "running": self._thread is not None and self._thread.is_alive(),
+            "error": self.error,
+        }
+
+
+class SampledLogger:
+    """Logs roughly `rate` of the calls it receives (1.0 logs everything)"""
+
+    def __init__(self, log: logging.Logger, rate: float = 0.01):
+        self.log = log
+        self.rate = rate
+
+    def _keep(self) -> bool:
+        return self.rate >= 1.0 or random.random() < self.rate
+
+    def info(self, msg: str, *args):
+        # %-style args so unsampled payloads are never formatted
+        if self._keep():
+            self.log.info(msg, *args)
+
+    def debug(self, msg: str, *args):
+        if self._keep():
+            self.log.debug(msg, *args)
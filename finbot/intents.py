@@ -0,0 +1,209 @@
+"""
+Instant answers for frequent voice intents.
+
+The intent table lives in a JSON file owned by the bank (INTENTS_FILE; see
+finbot/intents.example.json for the layout), not in code: each intent has
+example phrasings, near-miss phrasings that must not match (e.g. credit card
+vs debit card), a threshold and the approved answer that is read out to the
+caller verbatim. The file also carries calibration probes, held-out phrasings
+with the decision each must get.
+
+Everything is embedded once at startup; an incoming transcript is compared by
+cosine similarity and answered directly, without an LLM round-trip, only if
+the best intent clears its own threshold AND beats both the runner-up intent
+and the closest near-miss by `margin`. bge scores sit close together, so the
+margin does most of the work. `load_intent_matcher` only returns a matcher if
+every answer is filled in and every probe is decided correctly with the real
+model; `python -m finbot.calibrate_intents` shows the per-probe scores.
+
+Each lookup can be emitted to an EventSink as an `intent_lookup` event with
+the utterance and its scores, so misses can be tuned from real traffic.
+"""
+
+import json
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBED_MODEL = "BAAI/bge-base-en-v1.5"
+
+class Intent:
+    """One canonical question/answer pair with its own match threshold"""
+
+    def __init__(self, name: str, examples: List[str], answer: str,
+                 threshold: float = 0.85, near_misses: Optional[List[str]] = None):
+        self.name = name
+        self.examples = examples
+        self.answer = answer
+        self.threshold = threshold
+        self.near_misses = near_misses or []
+
+
+# (transcript, intent name it must be answered with, or None to fall through)
+Probe = Tuple[str, Optional[str]]
+
+
+def load_intent_file(path: str) -> Tuple[List[Intent], List[Probe]]:
+    """Read intents and calibration probes from a JSON intent file. Raises ValueError if malformed."""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    try:
+        intents = [
+            Intent(item["name"],
+                   list(item["examples"]),
+                   item.get("answer") or "",
+                   threshold=float(item.get("threshold", 0.85)),
+                   near_misses=list(item.get("near_misses", [])))
+            for item in data["intents"]
+        ]
+        probes = [(probe["text"], probe.get("intent")) for probe in data.get("probes", [])]
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"malformed intent file: {e!r}")
+    names = {intent.name for intent in intents}
+    if len(names) != len(intents):
+        raise ValueError("duplicate intent names")
+    unknown = {expected for _, expected in probes if expected is not None} - names
+    if unknown:
+        raise ValueError(f"probes name unknown intents: {sorted(unknown)}")
+    return intents, probes
+
+
+class IntentMatcher:
+    """Vector-similarity lookup of a transcript against precomputed intent examples"""
+
+    def __init__(self, encoder, intents: List[Intent],
+                 margin: float = 0.05, events=None):
+        self.encoder = encoder
+        self.intents = intents
+        self.margin = margin
+        self.events = events
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits: Dict[str, int] = {intent.name: 0 for intent in self.intents}
+
+        # Embed every example and near-miss once; row i belongs to intent
+        # self._owner[i], and near-miss rows are flagged in self._negative
+        texts, owner, negative = [], [], []
+        for i, intent in enumerate(self.intents):
+            texts.extend(intent.examples + intent.near_misses)
+            owner.extend([i] * (len(intent.examples) + len(intent.near_misses)))
+            negative.extend([False] * len(intent.examples) + [True] * len(intent.near_misses))
+        self._owner = np.asarray(owner)
+        self._negative = np.asarray(negative, dtype=bool)
+        self._vectors = self._encode(texts)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        vec = self.encoder.encode(texts, normalize_embeddings=True)
+        return np.asarray(vec, dtype="float32")
+
+    def explain(self, text: str) -> dict:
+        """Best intent, its score, the runner-up and closest near-miss scores, and the decision"""
+        result = {"intent": None, "score": 0.0, "runner_up": 0.0, "near_miss": 0.0, "hit": False}
+        if not text or not text.strip() or not len(self._vectors):
+            return result
+        scores = self._vectors @ self._encode([text])[0]
+
+        per_intent = np.full(len(self.intents), -1.0)
+        positive = ~self._negative
+        np.maximum.at(per_intent, self._owner[positive], scores[positive])
+        ranked = np.argsort(per_intent)[::-1]
+        best = self.intents[int(ranked[0])]
+        result["intent"] = best
+        result["score"] = float(per_intent[ranked[0]])
+        if len(ranked) > 1:
+            result["runner_up"] = float(per_intent[ranked[1]])
+        if self._negative.any():
+            result["near_miss"] = float(scores[self._negative].max())
+
+        rival = max(result["runner_up"], result["near_miss"])
+        result["hit"] = result["score"] >= best.threshold and result["score"] - rival >= self.margin
+        return result
+
+    def match(self, text: str, call_id: Optional[str] = None) -> Optional[Intent]:
+        """Intent the transcript confidently matches, or None"""
+        start = time.perf_counter()
+        result = self.explain(text)
+        intent, hit = result["intent"], result["hit"]
+        with self._lock:
+            self.lookups += 1
+            if hit:
+                self.hits[intent.name] += 1
+        if self.events is not None:
+            self.events.emit("intent_lookup", call_id, {
+                "intent": intent.name if intent else None,
+                "score": round(result["score"], 4),
+                "runner_up": round(result["runner_up"], 4),
+                "near_miss": round(result["near_miss"], 4),
+                "hit": hit,
+                "latency_ms": round((time.perf_counter() - start) * 1000, 2),
+                "text": text,
+            })
+        return intent if hit else None
+
+    def calibrate(self, probes: List[Probe]) -> List[dict]:
+        """explain() for every probe, plus the decision it got and whether that was the expected one"""
+        rows = []
+        for text, expected in probes:
+            result = self.explain(text)
+            got = result["intent"].name if result["hit"] else None
+            rows.append({**result, "text": text, "expected": expected, "got": got,
+                         "ok": got == expected})
+        return rows
+
+    def stats(self) -> dict:
+        """Lookup and per-intent hit counters"""
+        total_hits = sum(self.hits.values())
+        return {
+            "lookups": self.lookups,
+            "hits": total_hits,
+            "hit_rate": total_hits / self.lookups if self.lookups else 0.0,
+            "by_intent": dict(self.hits),
+            "thresholds": {intent.name: intent.threshold for intent in self.intents},
+            "margin": self.margin,
+        }
+
+
+def load_intent_matcher(path: str, model_name: str = EMBED_MODEL, margin: float = 0.05,
+                        events=None) -> Optional[IntentMatcher]:
+    """
+    Build the matcher from an intent file, or return None (instant answers
+    off) if the file or model is unavailable, an answer is missing, or any
+    calibration probe is decided wrongly.
+    """
+    try:
+        intents, probes = load_intent_file(path)
+    except (OSError, ValueError) as e:
+        logger.error(f"Instant answers disabled: cannot load {path}: {e}")
+        return None
+    unanswered = [intent.name for intent in intents if not intent.answer.strip()]
+    if unanswered:
+        logger.error(f"Instant answers disabled: no approved answer for {unanswered} in {path}")
+        return None
+    if not probes:
+        logger.error(f"Instant answers disabled: {path} has no calibration probes")
+        return None
+
+    try:
+        from sentence_transformers import SentenceTransformer
+        encoder = SentenceTransformer(model_name, device="cpu")
+        matcher = IntentMatcher(encoder, intents, margin=margin, events=events)
+    except ImportError:
+        logger.warning("sentence-transformers not installed; instant answers disabled")
+        return None
+    except Exception as e:
+        logger.error(f"Error loading intent matcher: {e}")
+        return None
+
+    failed = [row for row in matcher.calibrate(probes) if not row["ok"]]
+    if failed:
+        logger.error(f"Instant answers disabled: {len(failed)}/{len(probes)} calibration probes "
+                     f"failed with {model_name} (e.g. {failed[0]['text']!r} -> {failed[0]['got']}); "
+                     "run python -m finbot.calibrate_intents")
+        return None
+    logger.info(f"Instant answers enabled: {len(intents)} intents, {len(probes)} probes passed")
+    return matcher
@@ -1,6 +1,5 @@
 from sentence_transformers import SentenceTransformer
 import pathlib, textwrap, numpy as np, pickle, faiss
-from pypdf import PdfReader
 from tqdm import tqdm
 import faiss, numpy as np, pickle, json, os
 # from sentence_transformers import SentenceTransformer
@@ -9,15 +8,19 @@ import pickle
 import faiss
 import numpy as np
 import textwrap
+import requests
+from typing import List, Dict, Optional
 from sentence_transformers import SentenceTransformer
+from finbot.admission import AdmissionController, Overloaded, Priority
+from finbot.upstream import Upstream, keepalive_session
 
 
-model = SentenceTransformer("BAAI/bge-base-en-v1.5", device="cpu")  # or "cuda"
-PDF_DIR   = pathlib.Path("/content/")   # put your files here
+PDF_DIR   = pathlib.Path(os.getenv("PDF_DIR", "/content/"))   # put your files here
 CHUNK_SZ  = 512                    # characters per chunk
 OVERLAP   = 64
 
 def pdf_to_chunks(pdf_path):
+    from pypdf import PdfReader
     pages = PdfReader(str(pdf_path)).pages
     full_text = "\n".join(page.extract_text() or "" for page in pages)
     full_text = " ".join(full_text.split())        # collapse whitespace
@@ -25,32 +28,30 @@ def pdf_to_chunks(pdf_path):
     for i in range(0, len(full_text), CHUNK_SZ - OVERLAP):
         yield full_text[i : i + CHUNK_SZ]
 
-docs, texts = [], []               # metadata + raw text
-for pdf in tqdm(sorted(PDF_DIR.glob("*.pdf"))):
-    for chunk in pdf_to_chunks(pdf):
-        docs.append({"source": pdf.name, "text": chunk})
-        texts.append(chunk)
+def build_index(pdf_dir=PDF_DIR):
+    """Chunk and embed every PDF in pdf_dir, writing index.faiss and docs.pkl"""
+    docs, texts = [], []               # metadata + raw text
+    for pdf in tqdm(sorted(pathlib.Path(pdf_dir).glob("*.pdf"))):
+        for chunk in pdf_to_chunks(pdf):
+            docs.append({"source": pdf.name, "text": chunk})
+            texts.append(chunk)
 
-emb = model.encode(texts, batch_size=64,
-                   show_progress_bar=True, normalize_embeddings=True)
-emb = np.array(emb, dtype="float32")              # FAISS needs float32
+    if not texts:
+        print(f"Error: no PDF text found in {pdf_dir}, index not written")
+        return False
 
-index = faiss.IndexFlatIP(emb.shape[1])           # cosine similarity (because vectors are L2-normed)
-index.add(emb)
-faiss.write_index(index, "index.faiss")           # persist for later
+    model = SentenceTransformer("BAAI/bge-base-en-v1.5", device="cpu")  # or "cuda"
+    emb = model.encode(texts, batch_size=64,
+                       show_progress_bar=True, normalize_embeddings=True)
+    emb = np.array(emb, dtype="float32")              # FAISS needs float32
 
-with open("docs.pkl", "wb") as f:                 # keep metadata alongside
-    pickle.dump(docs, f)
+    index = faiss.IndexFlatIP(emb.shape[1])           # cosine similarity (because vectors are L2-normed)
+    index.add(emb)
+    faiss.write_index(index, "index.faiss")           # persist for later
 
-index  = faiss.read_index("index.faiss")
-docs   = pickle.load(open("docs.pkl", "rb"))
-model  = SentenceTransformer("BAAI/bge-base-en-v1.5")
-
-def retrieve(query, k=6):
-    q_emb = model.encode([query], normalize_embeddings=True)
-    D, I  = index.search(np.array(q_emb, dtype="float32"), k)
-    return [docs[idx] | {"score": float(D[0][rank])}
-            for rank, idx in enumerate(I[0])]
+    with open("docs.pkl", "wb") as f:                 # keep metadata alongside
+        pickle.dump(docs, f)
+    return True
 
 def load_rag_system():
     """Load the vector store and metadata with error handling"""
@@ -71,31 +72,46 @@ def load_rag_system():
 # Load the system
 index, docs, embed = load_rag_system()
 
-def retrieve(query, k=6):
-    """Retrieve relevant documents for a query"""
-    if index is None or docs is None or embed is None:
-        return []
+def retrieve_batch(queries: List[str], k: int = 6) -> List[List[Dict]]:
+    """Retrieve relevant documents for many queries with one encode and one search"""
+    if index is None or docs is None or embed is None or not queries:
+        return [[] for _ in queries]
 
     try:
-        vec = embed.encode([query], normalize_embeddings=True)
+        vec = embed.encode(queries, batch_size=64, normalize_embeddings=True)
         D, I = index.search(np.asarray(vec, dtype="float32"), k)
 
-        results = []
-        for rank, idx in enumerate(I[0]):
-            if idx < len(docs):  # Ensure valid index
-                doc = docs[idx].copy()
-                doc["score"] = float(D[0][rank])
-                results.append(doc)
-
-        return results
+        batch = []
+        for row in range(len(queries)):
+            results = []
+            for rank, idx in enumerate(I[row]):
+                if 0 <= idx < len(docs):  # Ensure valid index
+                    doc = docs[idx].copy()
+                    doc["score"] = float(D[row][rank])
+                    results.append(doc)
+            batch.append(results)
+
+        return batch
     except Exception as e:
         print(f"Error during retrieval: {e}")
-        return []
+        return [[] for _ in queries]
+
+def retrieve(query, k=6):
+    """Retrieve relevant documents for a query"""
+    return retrieve_batch([query], k)[0]
 
 # ───────────────────────────────────────────────────────────────
 # Web Search Integration using SERP API
 # ───────────────────────────────────────────────────────────────
 
+# Pooled keep-alive connection plus deadline/retry policy for SERP API. No
+# hedging: every duplicate would be another billed search with no governor.
+serp_session = keepalive_session()
+serp_upstream = Upstream("serpapi",
+                         deadline=float(os.getenv("SERP_DEADLINE", 8)),
+                         hedge=False,
+                         timeout_kwargs=lambda seconds: {"timeout": seconds})
+
 def web_search(query: str, num_results: int = 5) -> List[Dict]:
     """
     Search the web using SERP API
@@ -117,10 +133,12 @@ def web_search(query: str, num_results: int = 5) -> List[Dict]:
             "hl": "en"   # language
         }
 
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
+        def fetch(timeout):
+            response = serp_session.get(url, params=params, timeout=timeout)
+            response.raise_for_status()
+            return response.json()
 
-        data = response.json()
+        data = serp_upstream.call(fetch)
 
         results = []
         if "organic_results" in data:
@@ -145,25 +163,30 @@ def web_search(query: str, num_results: int = 5) -> List[Dict]:
         print(f"Unexpected error in web search: {e}")
         return []
 
-def should_use_web_search(local_results: List[Dict], score_threshold: float = 0.3) -> bool:
+def should_use_web_search(local_results: List[Dict], score_threshold: float = 0.3,
+                          verbose: bool = True) -> bool:
     """
     Determine if web search should be used based on local results quality
     FAISS cosine distance: 0.0 = perfect match, higher = less similar
     """
     if not local_results:
-        print("No local results found, using web search")
+        if verbose:
+            print("No local results found, using web search")
         return True
 
     # Get best (lowest) similarity score
     best_score = min(result["score"] for result in local_results)
-    print(f"Best local result score: {best_score:.3f} (threshold: {score_threshold})")
+    if verbose:
+        print(f"Best local result score: {best_score:.3f} (threshold: {score_threshold})")
 
     # If best score is above threshold, results are not good enough
     if best_score > score_threshold:
-        print("Local results quality insufficient, using web search")
+        if verbose:
+            print("Local results quality insufficient, using web search")
         return True
 
-    print("Local results sufficient, skipping web search")
+    if verbose:
+        print("Local results sufficient, skipping web search")
     return False
 
 # ───────────────────────────────────────────────────────────────
@@ -190,14 +213,55 @@ except Exception as e:
     print(f"Error configuring Gemini: {e}")
     genai = None
 
+# Bound concurrent/queued Gemini calls so a spike sheds fast instead of
+# every request hitting the rate limit at once
+gemini_governor = AdmissionController(
+    "gemini",
+    max_concurrency=int(os.getenv("GEMINI_MAX_CONCURRENCY", 8)),
+    rate=float(os.getenv("GEMINI_RATE_PER_SEC", 5)),
+    burst=float(os.getenv("GEMINI_BURST", 10)),
+    max_queue=int(os.getenv("GEMINI_MAX_QUEUE", 64)),
+)
+
+# Deadline/retry/hedge policy for Gemini; retries and hedges take their own
+# governor token and every attempt's timeout is the time left before the deadline
+gemini_upstream = Upstream("gemini",
+                           deadline=float(os.getenv("GEMINI_DEADLINE", 20)),
+                           governor=gemini_governor,
+                           timeout_kwargs=lambda seconds: {"request_options": {"timeout": seconds}})
+
+def start_warmup(interval: float = 30.0):
+    """
+    Keep the SERP API and Gemini connections warm with periodic pings.
+    For long-running services only; not started on import.
+    """
+    serp_upstream.start_warmup(lambda: serp_session.head("https://serpapi.com", timeout=5),
+                               interval=interval)
+    if genai is not None:
+        gemini_upstream.start_warmup(lambda: genai.get_model("models/gemini-1.5-flash",
+                                                             request_options={"timeout": 5}),
+                                     interval=interval)
+
+def stop_warmup():
+    serp_upstream.stop_warmup()
+    gemini_upstream.stop_warmup()
+
+OVERLOADED_ANSWER = "The assistant is busy right now, please try again in a moment."
+
 def rag_chat_with_websearch(question: str,
                            k: int = 6,
                            model_name: str = "gemini-1.5-flash",
                            temperature: float = 0.2,
                            use_web_fallback: bool = True,
-                           score_threshold: float = 0.7) -> str:
+                           score_threshold: float = 0.7,
+                           priority: Priority = Priority.CHAT,
+                           local_passages: Optional[List[Dict]] = None,
+                           verbose: bool = True) -> str:
     """
     Enhanced RAG chat function with web search fallback
+    Returns OVERLOADED_ANSWER when the Gemini budget is exhausted
+    Pass local_passages to reuse results from retrieve_batch
+    Pass verbose=False to silence the per-question progress prints
     """
     if genai is None:
         return "Error: Gemini client not available"
@@ -207,25 +271,30 @@ def rag_chat_with_websearch(question: str,
 
     try:
         # First, try local retrieval
-        local_passages = retrieve(question, k)
-        print(f"Local results found: {len(local_passages)}")
+        if local_passages is None:
+            local_passages = retrieve(question, k)
+        if verbose:
+            print(f"Local results found: {len(local_passages)}")
 
         # Determine if we should use web search
-        use_websearch = use_web_fallback and should_use_web_search(local_passages, score_threshold)
+        use_websearch = use_web_fallback and should_use_web_search(local_passages, score_threshold,
+                                                                   verbose=verbose)
 
         passages = local_passages
         context_sources = "local knowledge base"
 
         if use_websearch:
-            print("Local results insufficient, searching web...")
+            if verbose:
+                print("Local results insufficient, searching web...")
             web_results = web_search(question, num_results=3)
-            print(f"Web results found: {len(web_results)}")
+            if verbose:
+                print(f"Web results found: {len(web_results)}")
 
             if web_results:
                 # Combine local and web results
                 passages = local_passages + web_results
                 context_sources = "local knowledge base and web search"
-            else:
+            elif verbose:
                 print("Web search failed, using only local results")
 
         if not passages:
@@ -266,13 +335,19 @@ def rag_chat_with_websearch(question: str,
             system_instruction=system_instruction
         )
 
-        response = model.generate_content(
-            user_prompt,
-            generation_config=genai.types.GenerationConfig(temperature=temperature)
-        )
+        with gemini_governor.admit(priority):
+            response = gemini_upstream.call(
+                model.generate_content,
+                user_prompt,
+                generation_config=genai.types.GenerationConfig(temperature=temperature)
+            )
 
         return response.text
 
+    except Overloaded as e:
+        if verbose:
+            print(f"Shedding request: {e}")
+        return OVERLOADED_ANSWER
     except Exception as e:
         return f"Error generating response: {str(e)}"
 
@@ -293,6 +368,15 @@ def rag_chat_gemini(question: str,
 
 # 4. Test the system
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="FinBot RAG self-test")
+    parser.add_argument("--build-index", action="store_true",
+                        help="(re)build index.faiss and docs.pkl from the PDFs in --pdf-dir, then exit")
+    parser.add_argument("--pdf-dir", default=str(PDF_DIR))
+    args = parser.parse_args()
+    if args.build_index:
+        raise SystemExit(0 if build_index(args.pdf_dir) else 1)
+
     print("Initializing RAG system...")
 
     # Check individual components
@@ -341,6 +425,8 @@ if __name__ == "__main__":
         print("-" * 40)
         print(result_web)
 
+        print(f"\nGemini admission: {gemini_governor.stats()}")
+
     else:
         print("\n" + "="*60)
         print("RAG SYSTEM SETUP ISSUES:")
@@ -355,7 +441,9 @@ if __name__ == "__main__":
             print("❌ Google Generative AI not available")
 
         print("\nSetup checklist:")
-        print("1. Ensure index.faiss and docs.pkl exist in current directory")
+        print("1. Ensure index.faiss and docs.pkl exist in current directory "
+              "(build with: python -m finbot.main --build-index --pdf-dir <dir>)")
         print("2. Install: pip install sentence-transformers faiss-cpu google-generativeai requests")
         print("3. Set GEMINI_API_KEY environment variable")
         print("4. Verify SERP API key is working")
+        print("5. Run from the repo root: python -m finbot.main")
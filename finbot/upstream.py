@@ -0,0 +1,410 @@
+"""
+Shared layer for calls to upstream services (Mistral, Gemini, SERP API).
+
+`Upstream.call(fn, ...)` runs a blocking client call with:
+  - a per-call deadline covering all attempts,
+  - jittered exponential-backoff retries on transient errors,
+  - an optional hedged duplicate fired once the first attempt has been
+    outstanding longer than the observed p95 latency; the first successful
+    response wins and the other is discarded.
+
+Abandoned attempts (deadline passed, hedge lost) can't be interrupted, so
+`timeout_kwargs` maps the time left before the deadline to the client's own
+per-request timeout argument, and every attempt (first, hedge or retry) is
+sent with it; attempts still running are counted and new ones are refused
+with `Saturated` once `max_outstanding` is reached. With a `governor`, every
+retry and hedge takes its own token and none are sent while callers are
+queueing.
+
+`call_async` runs attempts on the same pool and awaits them directly, so an
+asyncio caller holds no thread of its own while it waits.
+
+`keepalive_session()` returns a pooled requests.Session, and
+`Upstream.start_warmup()` periodically pings an upstream so the first request
+after an idle period doesn't pay connection setup.
+
+Run `python -m finbot.upstream` to exercise hedging against a local mock
+server with injected latency.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from finbot.admission import AdmissionController
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when no attempt succeeded within the call deadline"""
+
+
+class Saturated(Exception):
+    """Raised when too many earlier attempts are still running to start another"""
+
+
+def keepalive_session(pool_size: int = 16) -> requests.Session:
+    """requests.Session with a persistent keep-alive connection pool"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Bugs in our own call, not transient upstream failures
+NOT_RETRYABLE = (TypeError, ValueError, AttributeError, KeyError, NotImplementedError)
+
+
+def _status_code(exc: Exception) -> Optional[int]:
+    """HTTP status from requests (exc.response), Mistral (exc.status_code) or Google (exc.code)"""
+    for status in (getattr(getattr(exc, "response", None), "status_code", None),
+                   getattr(exc, "status_code", None),
+                   getattr(exc, "code", None)):
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def is_retryable(exc: Exception) -> bool:
+    """Retry transient errors; not client errors (4xx other than 429) or programming errors"""
+    if isinstance(exc, (NOT_RETRYABLE, Saturated)):
+        return False
+    status = _status_code(exc)
+    if status is not None and 400 <= status < 500 and status != 429:
+        return False
+    return True
+
+
+class LatencyTracker:
+    """Rolling window of successful attempt latencies"""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q: float, min_samples: int = 20) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Upstream:
+    """Deadline, retry and hedging policy for one upstream service"""
+
+    def __init__(self,
+                 name: str,
+                 deadline: float = 10.0,
+                 retries: int = 2,
+                 backoff: float = 0.2,
+                 hedge: bool = True,
+                 hedge_quantile: float = 0.95,
+                 hedge_min_delay: float = 0.05,
+                 max_outstanding: int = 16,
+                 governor: Optional[AdmissionController] = None,
+                 timeout_kwargs: Optional[Callable[[float], Dict]] = None,
+                 retryable: Callable[[Exception], bool] = is_retryable):
+        self.name = name
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.retryable = retryable
+        self.governor = governor
+        self.timeout_kwargs = timeout_kwargs
+        self.max_outstanding = max_outstanding
+        self.latency = LatencyTracker()
+        self._pool = ThreadPoolExecutor(max_workers=max_outstanding,
+                                        thread_name_prefix=f"upstream-{name}")
+        self._lock = threading.Lock()
+        self._outstanding = 0
+        self.counters = {"calls": 0, "retries": 0, "hedges": 0, "hedge_wins": 0,
+                         "hedges_skipped": 0, "deadline_exceeded": 0,
+                         "saturated": 0, "errors": 0}
+        self._warmup_stop = None
+
+    def _count(self, key: str):
+        with self._lock:
+            self.counters[key] += 1
+
+    def hedge_delay(self) -> Optional[float]:
+        """How long to wait before firing a hedge, or None if not enough data yet"""
+        if not self.hedge:
+            return None
+        p = self.latency.quantile(self.hedge_quantile)
+        return None if p is None else max(self.hedge_min_delay, p)
+
+    def _timed(self, fn, args, kwargs):
+        try:
+            start = time.monotonic()
+            result = fn(*args, **kwargs)
+            self.latency.record(time.monotonic() - start)
+            return result
+        finally:
+            with self._lock:
+                self._outstanding -= 1
+
+    def _submit(self, fn, args, kwargs, end: float):
+        """Start an attempt, or return None if max_outstanding are still running"""
+        with self._lock:
+            if self._outstanding >= self.max_outstanding:
+                return None
+            self._outstanding += 1
+        if self.timeout_kwargs is not None:
+            # The attempt must give up by the call deadline, not a full deadline later
+            kwargs = {**kwargs, **self.timeout_kwargs(max(0.001, end - time.monotonic()))}
+        future = self._pool.submit(self._timed, fn, args, kwargs)
+        future.add_done_callback(self._cancelled_before_start)
+        return future
+
+    def _cancelled_before_start(self, future):
+        # _timed never ran, so it never gave back its outstanding slot
+        if future.cancelled():
+            with self._lock:
+                self._outstanding -= 1
+
+    def _submit_primary(self, fn, args, kwargs, end: float):
+        primary = self._submit(fn, args, kwargs, end)
+        if primary is None:
+            self._count("saturated")
+            raise Saturated(f"{self.name}: {self.max_outstanding} attempts still running")
+        return primary
+
+    def _submit_hedge(self, fn, args, kwargs, end: float):
+        hedge = self._submit(fn, args, kwargs, end) if self._hedge_allowed() else None
+        if hedge is None:
+            self._count("hedges_skipped")
+        else:
+            self._count("hedges")
+        return hedge
+
+    def _hedge_allowed(self) -> bool:
+        if self.governor is not None and self.governor.reserve_extra(0.0) is None:
+            return False
+        return True
+
+    def _attempt(self, fn, args, kwargs, end: float):
+        """One attempt, possibly hedged. Raises the attempt's error or DeadlineExceeded."""
+        primary = self._submit_primary(fn, args, kwargs, end)
+        pending = {primary}
+        delay = self.hedge_delay()
+        if delay is not None and delay < end - time.monotonic():
+            done, _ = wait(pending, timeout=delay)
+            if not done:
+                hedge = self._submit_hedge(fn, args, kwargs, end)
+                if hedge is not None:
+                    pending.add(hedge)
+
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, end - time.monotonic()),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        self._count("hedge_wins")
+                    # The loser can't be interrupted mid-request; drop its result.
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+                error = future.exception()
+        for other in pending:
+            other.cancel()
+        if error is not None and not pending:
+            raise error
+        raise DeadlineExceeded(f"{self.name}: no response within {self.deadline:.1f}s")
+
+    async def _attempt_async(self, fn, args, kwargs, end: float):
+        """`_attempt` for asyncio callers: awaits the pool futures instead of blocking on them"""
+        primary = asyncio.wrap_future(self._submit_primary(fn, args, kwargs, end))
+        pending = {primary}
+        try:
+            delay = self.hedge_delay()
+            if delay is not None and delay < end - time.monotonic():
+                done, _ = await asyncio.wait(pending, timeout=delay)
+                if not done:
+                    hedge = self._submit_hedge(fn, args, kwargs, end)
+                    if hedge is not None:
+                        pending.add(asyncio.wrap_future(hedge))
+
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending,
+                                                   timeout=max(0.0, end - time.monotonic()),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for future in done:
+                    if future.exception() is None:
+                        if future is not primary:
+                            self._count("hedge_wins")
+                        return future.result()
+                    error = future.exception()
+            if error is not None and not pending:
+                raise error
+            raise DeadlineExceeded(f"{self.name}: no response within {self.deadline:.1f}s")
+        finally:
+            # Also runs if the caller is cancelled; running attempts finish
+            # on their own, bounded by timeout_kwargs.
+            for other in pending:
+                other.cancel()
+
+    def _retry_delay(self, error: Exception, attempt: int, end: float) -> float:
+        """Seconds to wait before retrying after `error`, or re-raise it if no retry is allowed"""
+        # Full jitter: sleep uniformly in [0, backoff * 2^attempt]
+        sleep = random.uniform(0, self.backoff * (2 ** attempt))
+        if (attempt >= self.retries or not self.retryable(error)
+                or time.monotonic() + sleep >= end):
+            self._count("errors")
+            raise error
+        if self.governor is not None:
+            # A retry is a new upstream request: it needs its own token
+            token_wait = self.governor.reserve_extra(end - time.monotonic() - sleep)
+            if token_wait is None:
+                self._count("errors")
+                raise error
+            sleep += token_wait
+        self._count("retries")
+        logger.warning(f"{self.name} attempt {attempt + 1} failed ({error}), retrying")
+        return sleep
+
+    def call(self, fn: Callable, *args, **kwargs):
+        """Run fn(*args, **kwargs) under this upstream's deadline/retry/hedge policy"""
+        self._count("calls")
+        end = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            try:
+                return self._attempt(fn, args, kwargs, end)
+            except DeadlineExceeded:
+                self._count("deadline_exceeded")
+                raise
+            except Exception as e:
+                sleep = self._retry_delay(e, attempt, end)
+            attempt += 1
+            time.sleep(sleep)
+
+    async def call_async(self, fn: Callable, *args, **kwargs):
+        """`call` without blocking the event loop or holding a thread while waiting"""
+        self._count("calls")
+        end = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            try:
+                return await self._attempt_async(fn, args, kwargs, end)
+            except DeadlineExceeded:
+                self._count("deadline_exceeded")
+                raise
+            except Exception as e:
+                sleep = self._retry_delay(e, attempt, end)
+            attempt += 1
+            await asyncio.sleep(sleep)
+
+    def start_warmup(self, ping: Callable[[], object], interval: float = 30.0):
+        """Call ping() now and every `interval` seconds in a daemon thread"""
+        if self._warmup_stop is not None:
+            return
+        stop = self._warmup_stop = threading.Event()
+
+        def loop():
+            while True:
+                try:
+                    ping()
+                except Exception as e:
+                    logger.debug(f"{self.name} warm-up failed: {e}")
+                if stop.wait(interval):
+                    return
+
+        threading.Thread(target=loop, name=f"warmup-{self.name}", daemon=True).start()
+
+    def stop_warmup(self):
+        if self._warmup_stop is not None:
+            self._warmup_stop.set()
+            self._warmup_stop = None
+
+    def stats(self) -> dict:
+        """Counters plus current p50/p95 attempt latency"""
+        with self._lock:
+            counters = dict(self.counters)
+            outstanding = self._outstanding
+        return {
+            "upstream": self.name,
+            **counters,
+            "outstanding": outstanding,
+            "max_outstanding": self.max_outstanding,
+            "p50": self.latency.quantile(0.5, min_samples=1),
+            "p95": self.latency.quantile(0.95, min_samples=1),
+            "hedge_delay": self.hedge_delay(),
+        }
+
+
+# Check hedging against a local mock server with injected latency
+if __name__ == "__main__":
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    SLOW_EVERY, SLOW_SECONDS = 50, 1.0  # 2% of requests stall
+    hits = {"n": 0}
+    hits_lock = threading.Lock()
+
+    class MockHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+        wbufsize = -1  # send headers and body in one write
+
+        def do_GET(self):
+            with hits_lock:
+                hits["n"] += 1
+                n = hits["n"]
+            time.sleep(SLOW_SECONDS if n % SLOW_EVERY == 0 else 0.01)
+            body = b'{"ok": true}'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    session = keepalive_session()
+
+    def fetch():
+        response = session.get(url, timeout=5)
+        response.raise_for_status()
+        return response.json()
+
+    for hedge in (False, True):
+        hits["n"] = 0
+        upstream = Upstream("mock", deadline=5, hedge=hedge)
+        latencies = []
+        for _ in range(200):
+            start = time.monotonic()
+            upstream.call(fetch)
+            latencies.append(time.monotonic() - start)
+        latencies.sort()
+        print(f"hedge={hedge}: p50={latencies[100] * 1000:.0f}ms "
+              f"p99={latencies[198] * 1000:.0f}ms max={latencies[-1] * 1000:.0f}ms "
+              f"hedges={upstream.counters['hedges']} wins={upstream.counters['hedge_wins']}")
+
+    server.shutdown()
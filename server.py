@@ -25,6 +25,7 @@ import json
 import logging
 import os
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, Optional
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request, HTTPException
 from fastapi.responses import JSONResponse
@@ -34,6 +35,10 @@ from mistralai import Mistral
 from mistralai.models import UserMessage, SystemMessage, AssistantMessage
 import websockets
 from pydantic import BaseModel
+from finbot.admission import AdmissionController, Overloaded, Priority
+from finbot.intents import load_intent_matcher
+from finbot.upstream import Upstream
+from finbot.events import EventSink, SampledLogger
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -50,6 +55,32 @@ class Config:
     
     # WebSocket endpoint that Retell will connect to
     WEBSOCKET_PATH = "/llm-websocket"
+
+    # Admission control for Mistral calls
+    MISTRAL_MAX_CONCURRENCY = int(os.getenv("MISTRAL_MAX_CONCURRENCY", 8))
+    MISTRAL_RATE_PER_SEC = float(os.getenv("MISTRAL_RATE_PER_SEC", 5))
+    MISTRAL_BURST = float(os.getenv("MISTRAL_BURST", 10))
+    MISTRAL_MAX_QUEUE = int(os.getenv("MISTRAL_MAX_QUEUE", 32))
+    VOICE_QUEUE_TIMEOUT = float(os.getenv("VOICE_QUEUE_TIMEOUT", 1.5))
+    CHAT_QUEUE_TIMEOUT = float(os.getenv("CHAT_QUEUE_TIMEOUT", 5.0))
+
+    # Per-call deadline (all retries/hedges included; each attempt's SDK
+    # timeout is the time left before it) and warm-up interval
+    MISTRAL_DEADLINE = float(os.getenv("MISTRAL_DEADLINE", 8.0))
+    MISTRAL_WARMUP_INTERVAL = float(os.getenv("MISTRAL_WARMUP_INTERVAL", 30.0))
+
+    # Call-event store and hot-path log sampling
+    EVENT_DB = os.getenv("EVENT_DB", "call_events.db")
+    EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", 10000))
+    EVENT_FLUSH_INTERVAL = float(os.getenv("EVENT_FLUSH_INTERVAL", 1.0))
+    LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.01))
+
+    # Instant answers for frequent intents (skips Mistral on a confident match).
+    # Off by default; even when on, they stay off unless every intent in
+    # INTENTS_FILE has an approved answer and its calibration probes pass.
+    INSTANT_ANSWERS = os.getenv("INSTANT_ANSWERS", "false").lower() == "true"
+    INTENTS_FILE = os.getenv("INTENTS_FILE", "intents.json")
+    INTENT_MARGIN = float(os.getenv("INTENT_MARGIN", 0.05))
 # Initialize FastAPI appapp = FastAPI(title="Mistral AI + Retell AI Server", version="1.0.0")
 app = FastAPI(title="Mistral AI + Retell AI Server", version="1.0.0")
 
@@ -66,6 +97,48 @@ app.add_middleware(
 # Initialize Mistral client
 mistral_client = Mistral(api_key=Config.MISTRAL_API_KEY)
 
+# Bound concurrent/queued Mistral calls; voice turns are served ahead of chat
+mistral_governor = AdmissionController(
+    "mistral",
+    max_concurrency=Config.MISTRAL_MAX_CONCURRENCY,
+    rate=Config.MISTRAL_RATE_PER_SEC,
+    burst=Config.MISTRAL_BURST,
+    max_queue=Config.MISTRAL_MAX_QUEUE,
+    queue_timeout={
+        Priority.VOICE: Config.VOICE_QUEUE_TIMEOUT,
+        Priority.CHAT: Config.CHAT_QUEUE_TIMEOUT,
+    },
+)
+
+# Deadline/retry/hedge policy for Mistral; retries and hedges take their own
+# governor token and every attempt gets timeout_ms = time left before the
+# deadline. The model-list ping (started at startup) keeps the connection warm.
+mistral_upstream = Upstream("mistral",
+                            deadline=Config.MISTRAL_DEADLINE,
+                            governor=mistral_governor,
+                            timeout_kwargs=lambda seconds: {"timeout_ms": int(seconds * 1000)})
+
+OVERLOADED_RESPONSE = ("Sorry, we're handling a lot of calls right now. "
+                       "Could you give me a moment and ask that again?")
+
+# Webhook and turn events go to a bounded queue drained by a background
+# writer; per-message logging is sampled so it stays off the hot path
+call_events = EventSink(Config.EVENT_DB,
+                        max_queue=Config.EVENT_QUEUE_SIZE,
+                        flush_interval=Config.EVENT_FLUSH_INTERVAL)
+hot_log = SampledLogger(logger, Config.LOG_SAMPLE_RATE)
+
+# Built in the background at startup; lookups go to call_events. They run on
+# their own small pool so they never queue behind other to_thread work.
+intent_matcher = None
+intent_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="intents")
+
+def load_instant_answers():
+    global intent_matcher
+    intent_matcher = load_intent_matcher(Config.INTENTS_FILE,
+                                         margin=Config.INTENT_MARGIN,
+                                         events=call_events)
+
 # Store active connections
 active_connections: Dict[str, WebSocket] = {}
 
@@ -96,6 +169,7 @@ class MistralLLMHandler:
             
             # Extract user message
             user_message = message.get("transcript", [])
+            latest_message = ""
             if user_message:
                 # Add user message to conversation history
                 latest_message = user_message[-1]["content"] if user_message else ""
@@ -103,8 +177,17 @@ class MistralLLMHandler:
                     UserMessage(content=latest_message)
                 )
             
-            # Generate response using Mistral AI
-            response = await self.generate_mistral_response(call_id)
+            # Answer frequent intents directly, otherwise use Mistral AI
+            intent = None
+            matcher = intent_matcher
+            if matcher is not None and latest_message:
+                intent = await asyncio.get_running_loop().run_in_executor(
+                    intent_executor, matcher.match, latest_message, call_id)
+            if intent is not None:
+                hot_log.info("Instant answer for call %s: %s", call_id, intent.name)
+                response = intent.answer
+            else:
+                response = await self.generate_mistral_response(call_id)
             
             # Add assistant response to conversation history
             self.conversation_history[call_id].append(
@@ -133,8 +216,9 @@ class MistralLLMHandler:
             # Get conversation history
             messages = self.conversation_history.get(call_id, [])
             
-            # Add system message if this is the first message
-            if len(messages) == 1:
+            # Add system message if the conversation doesn't have one yet
+            # (earlier turns may have been answered without Mistral)
+            if messages and not isinstance(messages[0], SystemMessage):
                 system_message = SystemMessage(
                     content="You are a helpful AI assistant in a voice conversation. "
                            "Keep your responses conversational, concise, and natural for speech. "
@@ -142,24 +226,31 @@ class MistralLLMHandler:
                 )
                 messages.insert(0, system_message)
             
-            # Generate response using Mistral AI
-            if Config.MISTRAL_AGENT_ID and Config.MISTRAL_AGENT_ID != "your-agent-id":
-                # Use Mistral Agents API if agent ID is provided
-                response = mistral_client.agents.complete(
-                    agent_id=Config.MISTRAL_AGENT_ID,
-                    messages=messages
-                )
-            else:
-                # Use standard chat completion
-                response = mistral_client.chat.complete(
-                    model=Config.MISTRAL_MODEL,
-                    messages=messages,
-                    max_tokens=150,  # Keep responses concise for voice
-                    temperature=0.7
-                )
+            # Generate response using Mistral AI, off the event loop and
+            # only once admitted by the governor
+            async with mistral_governor.admit_async(Priority.VOICE):
+                if Config.MISTRAL_AGENT_ID and Config.MISTRAL_AGENT_ID != "your-agent-id":
+                    # Use Mistral Agents API if agent ID is provided
+                    response = await mistral_upstream.call_async(
+                        mistral_client.agents.complete,
+                        agent_id=Config.MISTRAL_AGENT_ID,
+                        messages=messages
+                    )
+                else:
+                    # Use standard chat completion
+                    response = await mistral_upstream.call_async(
+                        mistral_client.chat.complete,
+                        model=Config.MISTRAL_MODEL,
+                        messages=messages,
+                        max_tokens=150,  # Keep responses concise for voice
+                        temperature=0.7
+                    )
             
             return response.choices[0].message.content
             
+        except Overloaded as e:
+            logger.warning(f"Shedding Mistral call for {call_id}: {e}")
+            return OVERLOADED_RESPONSE
         except Exception as e:
             logger.error(f"Error generating Mistral response: {e}")
             return "I apologize, but I'm having trouble generating a response right now."
@@ -167,6 +258,37 @@ class MistralLLMHandler:
 # Initialize LLM handler
 llm_handler = MistralLLMHandler()
 
+def frame_summary(message: dict) -> dict:
+    """
+    What to store for a WebSocket frame. Retell resends the whole transcript
+    on every frame, so only the final call_ended frame keeps it; other frames
+    keep their type, response_id and latest utterance.
+    """
+    if message.get("type") == "call_ended":
+        return message
+    transcript = message.get("transcript")
+    return {
+        "type": message.get("type") or message.get("interaction_type"),
+        "response_id": message.get("response_id"),
+        "latest": transcript[-1] if isinstance(transcript, list) and transcript else None,
+    }
+
+@app.on_event("startup")
+async def start_background_work():
+    call_events.start()
+    mistral_upstream.start_warmup(lambda: mistral_client.models.list(timeout_ms=5000),
+                                  interval=Config.MISTRAL_WARMUP_INTERVAL)
+    if Config.INSTANT_ANSWERS:
+        # Loading the embedding model can be slow (or retry for a while with
+        # no network); turns are answered by Mistral until it is ready
+        intent_executor.submit(load_instant_answers)
+
+@app.on_event("shutdown")
+async def stop_background_work():
+    mistral_upstream.stop_warmup()
+    intent_executor.shutdown(wait=False, cancel_futures=True)
+    call_events.stop()
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
@@ -187,10 +309,11 @@ async def retell_webhook(request: Request):
     """Handle Retell AI webhooks"""
     try:
         data = await request.json()
-        logger.info(f"Received webhook: {data}")
-        
-        # Process webhook data as needed
-        # This could include call start/end events, etc.
+        call = data.get("call") if isinstance(data, dict) else None
+        call_id = call.get("call_id") if isinstance(call, dict) else None
+        event = data.get("event", "unknown") if isinstance(data, dict) else "unknown"
+        call_events.emit(f"webhook:{event}", call_id, data)
+        hot_log.info("Received webhook %s for call %s", event, call_id)
         
         return JSONResponse(content={"status": "received"})
     except Exception as e:
@@ -207,6 +330,7 @@ async def websocket_endpoint(websocket: WebSocket):
     active_connections[call_id] = websocket
     
     logger.info(f"New WebSocket connection established: {call_id}")
+    call_events.emit("connected", call_id)
     
     try:
         while True:
@@ -214,7 +338,8 @@ async def websocket_endpoint(websocket: WebSocket):
             data = await websocket.receive_text()
             message = json.loads(data)
             
-            logger.info(f"Received message: {message}")
+            call_events.emit("received", call_id, frame_summary(message))
+            hot_log.info("Received message for call %s: %s", call_id, message)
             
             # Handle different message types
             if message.get("type") == "response_required":
@@ -223,7 +348,8 @@ async def websocket_endpoint(websocket: WebSocket):
                 
                 # Send response back to Retell
                 await websocket.send_text(json.dumps(response))
-                logger.info(f"Sent response: {response}")
+                call_events.emit("responded", call_id, response)
+                hot_log.info("Sent response for call %s: %s", call_id, response)
                 
             elif message.get("type") == "ping":
                 # Respond to ping with pong
@@ -242,6 +368,7 @@ async def websocket_endpoint(websocket: WebSocket):
         logger.error(f"WebSocket error: {e}")
     finally:
         # Clean up
+        call_events.emit("disconnected", call_id)
         if call_id in active_connections:
             del active_connections[call_id]
         if call_id in llm_handler.conversation_history:
@@ -255,6 +382,7 @@ async def websocket_call_endpoint(websocket: WebSocket, call_id: str):
     active_connections[call_id] = websocket
     
     logger.info(f"New Retell call WebSocket connection established: {call_id}")
+    call_events.emit("connected", call_id)
     
     try:
         while True:
@@ -262,7 +390,8 @@ async def websocket_call_endpoint(websocket: WebSocket, call_id: str):
             data = await websocket.receive_text()
             message = json.loads(data)
             
-            logger.info(f"Received message for call {call_id}: {message}")
+            call_events.emit("received", call_id, frame_summary(message))
+            hot_log.info("Received message for call %s: %s", call_id, message)
             
             # Handle different message types
             if message.get("type") == "response_required":
@@ -271,7 +400,8 @@ async def websocket_call_endpoint(websocket: WebSocket, call_id: str):
                 
                 # Send response back to Retell
                 await websocket.send_text(json.dumps(response))
-                logger.info(f"Sent response for call {call_id}: {response}")
+                call_events.emit("responded", call_id, response)
+                hot_log.info("Sent response for call %s: %s", call_id, response)
                 
             elif message.get("type") == "ping":
                 # Respond to ping with pong
@@ -290,6 +420,7 @@ async def websocket_call_endpoint(websocket: WebSocket, call_id: str):
         logger.error(f"WebSocket error for call {call_id}: {e}")
     finally:
         # Clean up
+        call_events.emit("disconnected", call_id)
         if call_id in active_connections:
             del active_connections[call_id]
         if call_id in llm_handler.conversation_history:
@@ -304,17 +435,20 @@ async def test_mistral_connection():
             UserMessage(content="Hello, can you hear me?")
         ]
         
-        if Config.MISTRAL_AGENT_ID and Config.MISTRAL_AGENT_ID != "your-agent-id":
-            response = mistral_client.agents.complete(
-                agent_id=Config.MISTRAL_AGENT_ID,
-                messages=test_messages
-            )
-        else:
-            response = mistral_client.chat.complete(
-                model=Config.MISTRAL_MODEL,
-                messages=test_messages,
-                max_tokens=50
-            )
+        async with mistral_governor.admit_async(Priority.CHAT):
+            if Config.MISTRAL_AGENT_ID and Config.MISTRAL_AGENT_ID != "your-agent-id":
+                response = await mistral_upstream.call_async(
+                    mistral_client.agents.complete,
+                    agent_id=Config.MISTRAL_AGENT_ID,
+                    messages=test_messages
+                )
+            else:
+                response = await mistral_upstream.call_async(
+                    mistral_client.chat.complete,
+                    model=Config.MISTRAL_MODEL,
+                    messages=test_messages,
+                    max_tokens=50
+                )
         
         return {
             "status": "success",
@@ -338,6 +472,28 @@ async def get_active_connections():
         "connection_ids": list(active_connections.keys())
     }
 
+@app.get("/intents")
+async def get_intent_stats():
+    """Instant-answer lookups and hits per intent"""
+    if intent_matcher is None:
+        return {"enabled": False, "configured": Config.INSTANT_ANSWERS}
+    return {"enabled": True, **intent_matcher.stats()}
+
+@app.get("/upstream")
+async def get_upstream_stats():
+    """Latency, retry and hedging counters for upstream calls"""
+    return {"mistral": mistral_upstream.stats()}
+
+@app.get("/events")
+async def get_event_stats():
+    """Call-event queue depth and write/drop counters"""
+    return call_events.stats()
+
+@app.get("/admission")
+async def get_admission_stats():
+    """Queue depth, in-flight calls and shed counts for upstream LLM calls"""
+    return {"mistral": mistral_governor.stats()}
+
 if __name__ == "__main__":
     # Print configuration info
     print(f"🚀 Starting Mistral AI + Retell AI Server")
@@ -0,0 +1,186 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from finbot.admission import AdmissionController, Overloaded, Priority, TokenBucket
+
+
+def hold(ctrl, priority=Priority.CHAT):
+    """Take a slot in a background thread; set the returned event to release it"""
+    entered, release = threading.Event(), threading.Event()
+
+    def run():
+        with ctrl.admit(priority):
+            entered.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    assert entered.wait(2)
+    return release, thread
+
+
+def queue_in_thread(ctrl, priority, timeout, results, key):
+    def run():
+        try:
+            with ctrl.admit(priority, timeout=timeout):
+                results.append(key)
+        except Overloaded as e:
+            results.append((key, e.reason))
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def wait_for(predicate, timeout=2.0):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if predicate():
+            return True
+        time.sleep(0.005)
+    return False
+
+
+def test_token_bucket_refuses_beyond_max_wait():
+    bucket = TokenBucket(rate=10, capacity=1)
+    assert bucket.reserve(0) == 0.0
+    assert bucket.reserve(0) is None
+    wait = bucket.reserve(1.0)
+    assert 0 < wait <= 0.1
+
+
+def test_queued_caller_is_shed_at_its_deadline():
+    ctrl = AdmissionController("t", max_concurrency=1)
+    release, thread = hold(ctrl)
+    with pytest.raises(Overloaded, match="queue deadline exceeded"):
+        with ctrl.admit(Priority.CHAT, timeout=0.05):
+            pass
+    release.set()
+    thread.join(2)
+    stats = ctrl.stats()
+    assert stats["shed"]["deadline"] == 1
+    assert stats["queue_depth"] == 0
+    assert stats["in_flight"] == 0
+
+
+def test_released_slot_goes_to_highest_priority():
+    ctrl = AdmissionController("t", max_concurrency=1)
+    release, holder = hold(ctrl)
+    order = []
+    batch = queue_in_thread(ctrl, Priority.BATCH, 2, order, "batch")
+    assert wait_for(lambda: ctrl.stats()["queue_depth"] == 1)
+    voice = queue_in_thread(ctrl, Priority.VOICE, 2, order, "voice")
+    assert wait_for(lambda: ctrl.stats()["queue_depth"] == 2)
+    release.set()
+    for thread in (holder, batch, voice):
+        thread.join(2)
+    assert order == ["voice", "batch"]
+
+
+def test_full_queue_preempts_lower_priority():
+    ctrl = AdmissionController("t", max_concurrency=1, max_queue=1)
+    release, holder = hold(ctrl)
+    results = []
+    batch = queue_in_thread(ctrl, Priority.BATCH, 2, results, "batch")
+    assert wait_for(lambda: ctrl.stats()["queue_depth"] == 1)
+    voice = queue_in_thread(ctrl, Priority.VOICE, 2, results, "voice")
+    batch.join(2)
+    assert results == [("batch", "preempted by higher priority call")]
+    release.set()
+    for thread in (holder, voice):
+        thread.join(2)
+    assert results[-1] == "voice"
+    assert ctrl.stats()["shed"]["preempted"] == 1
+
+
+def test_full_queue_rejects_equal_priority():
+    ctrl = AdmissionController("t", max_concurrency=1, max_queue=1)
+    release, holder = hold(ctrl)
+    results = []
+    first = queue_in_thread(ctrl, Priority.VOICE, 2, results, "first")
+    assert wait_for(lambda: ctrl.stats()["queue_depth"] == 1)
+    with pytest.raises(Overloaded, match="queue full"):
+        with ctrl.admit(Priority.VOICE):
+            pass
+    release.set()
+    for thread in (holder, first):
+        thread.join(2)
+    assert results == ["first"]
+    assert ctrl.stats()["shed"]["queue_full"] == 1
+
+
+def test_rate_limit_sheds_and_releases_slot():
+    ctrl = AdmissionController("t", max_concurrency=4, rate=1, burst=1)
+    with ctrl.admit(Priority.CHAT):
+        pass
+    with pytest.raises(Overloaded, match="rate limit"):
+        with ctrl.admit(Priority.CHAT, timeout=0.1):
+            pass
+    stats = ctrl.stats()
+    assert stats["shed"]["rate_limited"] == 1
+    assert stats["in_flight"] == 0
+
+
+def test_async_cancellation_is_not_counted_as_shed():
+    ctrl = AdmissionController("t", max_concurrency=1)
+
+    async def scenario():
+        async with ctrl.admit_async(Priority.VOICE):
+            async def waiter():
+                async with ctrl.admit_async(Priority.VOICE, timeout=5):
+                    pass
+
+            task = asyncio.create_task(waiter())
+            await asyncio.sleep(0.05)
+            assert ctrl.stats()["queue_depth"] == 1
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+    asyncio.run(scenario())
+    stats = ctrl.stats()
+    assert stats["cancelled"] == 1
+    assert stats["shed_total"] == 0
+    assert stats["queue_depth"] == 0
+    assert stats["in_flight"] == 0
+
+
+def test_async_waiter_admitted_when_slot_frees():
+    ctrl = AdmissionController("t", max_concurrency=1)
+
+    async def scenario():
+        order = []
+
+        async def call(name, hold_for):
+            async with ctrl.admit_async(Priority.CHAT):
+                order.append(name)
+                await asyncio.sleep(hold_for)
+
+        await asyncio.gather(call("a", 0.05), call("b", 0))
+        return order
+
+    assert asyncio.run(scenario()) == ["a", "b"]
+    assert ctrl.stats()["admitted"] == 2
+
+
+def test_reserve_extra_refused_while_callers_queue():
+    ctrl = AdmissionController("t", max_concurrency=1, rate=100, burst=10)
+    assert ctrl.reserve_extra(0) == 0.0
+    release, holder = hold(ctrl)
+    results = []
+    queued = queue_in_thread(ctrl, Priority.CHAT, 2, results, "queued")
+    assert wait_for(lambda: ctrl.stats()["queue_depth"] == 1)
+    assert ctrl.reserve_extra(1.0) is None
+    release.set()
+    for thread in (holder, queued):
+        thread.join(2)
+    assert ctrl.stats()["extra_attempts"] == {"granted": 1, "refused": 1}
+
+
+def test_reserve_extra_refused_when_bucket_empty():
+    ctrl = AdmissionController("t", rate=1, burst=1)
+    assert ctrl.reserve_extra(0) == 0.0
+    assert ctrl.reserve_extra(0) is None
@@ -0,0 +1,64 @@
+import sqlite3
+import time
+
+from finbot.events import EventSink
+
+
+def rows(path):
+    db = sqlite3.connect(path)
+    try:
+        return db.execute("SELECT kind, call_id FROM call_events ORDER BY id").fetchall()
+    finally:
+        db.close()
+
+
+def test_events_are_written_on_stop(tmp_path):
+    path = str(tmp_path / "events.db")
+    sink = EventSink(path, flush_interval=0.05)
+    sink.start()
+    sink.emit("connected", "call-1")
+    sink.emit("received", "call-1", {"type": "update_only"})
+    sink.stop()
+    assert rows(path) == [("connected", "call-1"), ("received", "call-1")]
+    assert sink.stats()["written"] == 2
+
+
+def test_unserializable_event_is_skipped(tmp_path):
+    path = str(tmp_path / "events.db")
+    circular = {}
+    circular["self"] = circular
+    sink = EventSink(path, flush_interval=0.05)
+    sink.start()
+    sink.emit("bad", "call-1", circular)
+    sink.emit("good", "call-1")
+    sink.stop()
+    assert rows(path) == [("good", "call-1")]
+    stats = sink.stats()
+    assert stats["write_errors"] == 1
+    assert stats["error"] is None
+
+
+def test_writer_that_cannot_open_reports_and_drops(tmp_path):
+    sink = EventSink(str(tmp_path / "missing" / "events.db"))
+    sink.start()
+    sink._thread.join(2)
+    sink.emit("connected", "call-1")
+    stats = sink.stats()
+    assert stats["running"] is False
+    assert "cannot open" in stats["error"]
+    assert stats["dropped"] == 1
+
+
+def test_writer_crash_reports_and_drops(tmp_path, monkeypatch):
+    sink = EventSink(str(tmp_path / "events.db"), flush_interval=0.05)
+
+    def crash(db, batch):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(sink, "_write", crash)
+    sink.start()
+    sink.emit("connected", "call-1")
+    sink._thread.join(2)
+    assert "boom" in sink.stats()["error"]
+    sink.emit("received", "call-1")
+    assert sink.stats()["dropped"] == 1
@@ -0,0 +1,89 @@
+import json
+import pathlib
+import re
+
+import numpy as np
+import pytest
+
+from finbot.intents import Intent, IntentMatcher, load_intent_file, load_intent_matcher
+
+
+class BagOfWords:
+    """Deterministic stand-in for the sentence encoder"""
+
+    def encode(self, texts, normalize_embeddings=True):
+        vectors = np.zeros((len(texts), 256))
+        for row, text in enumerate(texts):
+            for word in re.findall(r"\w+", text.lower()):
+                vectors[row, sum(map(ord, word)) % 256] += 1
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+
+class Sink:
+    def __init__(self):
+        self.events = []
+
+    def emit(self, kind, call_id=None, payload=None):
+        self.events.append((kind, call_id, payload))
+
+
+INTENTS = [
+    Intent("lost_debit_card", ["I lost my debit card"], "answer",
+           threshold=0.6, near_misses=["I lost my credit card"]),
+    Intent("balance_enquiry", ["what is my account balance"], "answer", threshold=0.6),
+]
+
+
+def test_match_and_near_miss_rejection():
+    sink = Sink()
+    matcher = IntentMatcher(BagOfWords(), INTENTS, events=sink)
+    assert matcher.match("I lost my debit card", "call-1").name == "lost_debit_card"
+    assert matcher.match("I lost my credit card", "call-1") is None
+    assert matcher.stats()["lookups"] == 2
+    assert matcher.stats()["hits"] == 1
+    kind, call_id, payload = sink.events[1]
+    assert (kind, call_id) == ("intent_lookup", "call-1")
+    assert payload["text"] == "I lost my credit card"
+    assert payload["hit"] is False
+
+
+def test_calibrate_reports_wrong_decisions():
+    matcher = IntentMatcher(BagOfWords(), INTENTS)
+    rows = matcher.calibrate([("I lost my debit card", "lost_debit_card"),
+                              ("I lost my credit card", "lost_debit_card")])
+    assert [row["ok"] for row in rows] == [True, False]
+
+
+def write_file(tmp_path, intents, probes):
+    path = tmp_path / "intents.json"
+    path.write_text(json.dumps({"intents": intents, "probes": probes}))
+    return str(path)
+
+
+def test_load_intent_file(tmp_path):
+    path = write_file(tmp_path,
+                      [{"name": "a", "examples": ["x"], "answer": "y", "threshold": 0.9}],
+                      [{"text": "x", "intent": "a"}, {"text": "z", "intent": None}])
+    intents, probes = load_intent_file(path)
+    assert intents[0].threshold == 0.9
+    assert probes == [("x", "a"), ("z", None)]
+
+
+def test_load_intent_file_rejects_unknown_probe_intent(tmp_path):
+    path = write_file(tmp_path, [{"name": "a", "examples": ["x"]}],
+                      [{"text": "x", "intent": "b"}])
+    with pytest.raises(ValueError, match="unknown intents"):
+        load_intent_file(path)
+
+
+def test_matcher_stays_off_without_approved_answers(tmp_path):
+    path = write_file(tmp_path, [{"name": "a", "examples": ["x"], "answer": ""}],
+                      [{"text": "x", "intent": "a"}])
+    assert load_intent_matcher(path) is None
+
+
+def test_example_file_loads():
+    intents, probes = load_intent_file(
+        str(pathlib.Path(__file__).parent.parent / "finbot" / "intents.example.json"))
+    assert intents and probes
@@ -0,0 +1,220 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from finbot.admission import AdmissionController, Priority
+from finbot.upstream import DeadlineExceeded, Saturated, Upstream, is_retryable, keepalive_session
+
+
+class MockServer:
+    """Local HTTP server answering with scripted (status, delay) pairs, then (200, 0)"""
+
+    def __init__(self):
+        self.script = deque()
+        self.hits = 0
+        self.lock = threading.Lock()
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            wbufsize = -1
+
+            def do_GET(self):
+                with mock.lock:
+                    mock.hits += 1
+                    status, delay = mock.script.popleft() if mock.script else (200, 0.0)
+                time.sleep(delay)
+                body = b'{"ok": true}'
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def mock():
+    server = MockServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def fetch(mock):
+    session = keepalive_session()
+    timeouts = []
+
+    def fetch(timeout=5.0):
+        timeouts.append(timeout)
+        response = session.get(mock.url, timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+
+    fetch.timeouts = timeouts
+    yield fetch
+    session.close()
+
+
+def upstream(**kwargs):
+    kwargs.setdefault("backoff", 0.01)
+    kwargs.setdefault("hedge", False)
+    return Upstream("mock", **kwargs)
+
+
+def prime_latency(up, seconds=0.02):
+    for _ in range(20):
+        up.latency.record(seconds)
+
+
+def test_retries_transient_error(mock, fetch):
+    mock.script.append((503, 0.0))
+    up = upstream(retries=2)
+    assert up.call(fetch) == {"ok": True}
+    assert mock.hits == 2
+    assert up.counters["retries"] == 1
+
+
+def test_gives_up_after_retries(mock, fetch):
+    mock.script.extend([(503, 0.0)] * 3)
+    up = upstream(retries=2)
+    with pytest.raises(requests.HTTPError):
+        up.call(fetch)
+    assert mock.hits == 3
+    assert up.counters["errors"] == 1
+
+
+def test_client_error_not_retried(mock, fetch):
+    mock.script.append((404, 0.0))
+    up = upstream(retries=2)
+    with pytest.raises(requests.HTTPError):
+        up.call(fetch)
+    assert mock.hits == 1
+    assert up.counters["retries"] == 0
+
+
+def test_rate_limited_is_retryable():
+    class Throttled(Exception):
+        status_code = 429
+
+    class Rejected(Exception):
+        code = 400
+
+    assert is_retryable(Throttled())
+    assert not is_retryable(Rejected())
+    assert not is_retryable(TypeError("bad argument"))
+
+
+def test_deadline_bounds_call_and_attempt_timeout(mock, fetch):
+    mock.script.append((200, 1.0))
+    up = upstream(deadline=0.3, timeout_kwargs=lambda seconds: {"timeout": seconds})
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        up.call(fetch)
+    assert time.monotonic() - start < 0.6
+    assert up.counters["deadline_exceeded"] == 1
+    assert fetch.timeouts[0] <= 0.3
+
+
+def test_retry_gets_only_remaining_time(mock, fetch):
+    mock.script.append((503, 0.2))
+    up = upstream(deadline=1.0, timeout_kwargs=lambda seconds: {"timeout": seconds})
+    up.call(fetch)
+    first, retry = fetch.timeouts
+    assert retry <= first - 0.2
+
+
+def test_saturated_when_abandoned_attempts_still_running(mock, fetch):
+    mock.script.append((200, 1.0))
+    up = upstream(deadline=0.2, max_outstanding=1)
+    with pytest.raises(DeadlineExceeded):
+        up.call(fetch)
+    with pytest.raises(Saturated):
+        up.call(fetch)
+    assert up.counters["saturated"] == 1
+    assert mock.hits == 1
+
+
+def test_hedge_wins_over_slow_primary(mock, fetch):
+    mock.script.append((200, 1.0))
+    up = upstream(deadline=3, hedge=True)
+    prime_latency(up)
+    start = time.monotonic()
+    assert up.call(fetch) == {"ok": True}
+    assert time.monotonic() - start < 0.5
+    assert up.counters["hedges"] == 1
+    assert up.counters["hedge_wins"] == 1
+
+
+def test_governor_refuses_hedge_and_retry_while_callers_queue(mock, fetch):
+    governor = AdmissionController("mock", max_concurrency=1, rate=100, burst=10)
+    entered, release = threading.Event(), threading.Event()
+
+    def queued_caller():
+        with governor.admit(Priority.BATCH, timeout=5):
+            entered.set()
+
+    with governor.admit(Priority.CHAT):
+        waiter = threading.Thread(target=queued_caller, daemon=True)
+        waiter.start()
+        while governor.stats()["queue_depth"] == 0:
+            time.sleep(0.005)
+
+        mock.script.extend([(200, 0.3), (503, 0.0)])
+        up = upstream(deadline=3, hedge=True, retries=2, governor=governor)
+        prime_latency(up)
+        assert up.call(fetch) == {"ok": True}
+        assert up.counters["hedges_skipped"] == 1
+
+        with pytest.raises(requests.HTTPError):
+            up.call(fetch)
+        assert up.counters["retries"] == 0
+    waiter.join(2)
+    assert entered.is_set()
+    assert governor.stats()["extra_attempts"]["refused"] == 2
+
+
+def test_call_async_holds_no_default_executor_thread(mock, fetch):
+    mock.script.extend([(200, 0.5)] * 4)
+    up = upstream(deadline=3, max_outstanding=8)
+
+    async def scenario():
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=1))
+        calls = [asyncio.create_task(up.call_async(fetch)) for _ in range(4)]
+        await asyncio.sleep(0.1)
+        assert up.stats()["outstanding"] == 4
+        start = time.monotonic()
+        await asyncio.to_thread(lambda: None)
+        unrelated = time.monotonic() - start
+        results = await asyncio.gather(*calls)
+        return unrelated, results
+
+    unrelated, results = asyncio.run(scenario())
+    assert unrelated < 0.1
+    assert results == [{"ok": True}] * 4
+
+
+def test_call_async_retries_and_deadline(mock, fetch):
+    up = upstream(deadline=0.3, retries=2)
+    mock.script.extend([(503, 0.0), (200, 1.0)])
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(up.call_async(fetch))
+    assert up.counters["retries"] == 1
+    assert up.counters["deadline_exceeded"] == 1